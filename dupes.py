@@ -0,0 +1,401 @@
+"""Find duplicate films on the shares, and files Radarr doesn't know about.
+
+With a stub SMB connection serving a small share, where one directory can't be
+listed and one file disappears before it can be read in full:
+
+>>> from concurrent.futures import ThreadPoolExecutor
+>>> from types import SimpleNamespace
+>>> def entry(filename, size=None):
+...     return SimpleNamespace(
+...         filename=filename, isDirectory=size is None, file_size=size or 0
+...     )
+>>> TREE = {
+...     "/": [
+...         entry("."),
+...         entry(".."),
+...         entry("locked"),
+...         entry("Films"),
+...         entry("a.mkv", 300),
+...     ],
+...     "/Films": [
+...         entry("a copy.mkv", 300),
+...         entry("b.mkv", 300),
+...         entry("gone.mkv", 300),
+...         entry("notes.txt", 300),
+...     ],
+... }
+>>> DATA = {
+...     "/a.mkv": b"a" * 300,
+...     "/Films/a copy.mkv": b"a" * 300,
+...     "/Films/b.mkv": b"a" * 50 + b"b" + b"a" * 249,
+...     "/Films/gone.mkv": b"a" * 300,
+... }
+>>> class Stub:
+...     def listPath(self, share, directory):
+...         if directory not in TREE:
+...             raise RuntimeError(f"access denied {directory}")
+...         return TREE[directory]
+...     def retrieveFileFromOffset(self, share, path, file_obj, offset, max_length):
+...         file_obj.write(DATA[path][offset : offset + max_length])
+...     def retrieveFile(self, share, path, file_obj):
+...         if path == "/Films/gone.mkv":
+...             raise RuntimeError("file not found")
+...         file_obj.write(DATA[path])
+...     def close(self):
+...         pass
+>>> connections = _Connections(Stub)
+>>> pool = ThreadPoolExecutor(2)
+>>> skipped = []
+>>> files = scan_shares(connections, ["Media"], pool, min_size=0, skipped=skipped)
+Skipping Media:/locked: RuntimeError('access denied /locked')
+>>> [f["path"] for f in files]
+['/a.mkv', '/Films/a copy.mkv', '/Films/b.mkv', '/Films/gone.mkv']
+
+Sampling the head, middle and tail of each file misses where b.mkv differs, so
+only the full hash tells it apart.  Files that can't be read are skipped:
+
+>>> def paths(groups):
+...     return [[f["path"] for f in group] for group in groups]
+>>> paths(find_duplicates(connections, files, pool, sample_size=10, confirm=False))
+[['/a.mkv', '/Films/a copy.mkv', '/Films/b.mkv', '/Films/gone.mkv']]
+>>> paths(find_duplicates(connections, files, pool, sample_size=10, skipped=skipped))
+Skipping Media:/Films/gone.mkv: RuntimeError('file not found')
+[['/a.mkv', '/Films/a copy.mkv']]
+>>> skipped
+['Media:/locked', 'Media:/Films/gone.mkv']
+>>> pool.shutdown()
+"""
+import contextvars
+import hashlib
+import threading
+from collections import defaultdict
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import closing
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    TypedDict,
+)
+
+from radarrapi import PATH_SHARE_MAP, get_movies, share_path, smb_connect
+from utils import get_by_path, humanbytes_storage
+
+VIDEO_EXTENSIONS = {
+    ".avi",
+    ".iso",
+    ".m2ts",
+    ".m4v",
+    ".mkv",
+    ".mov",
+    ".mp4",
+    ".mpg",
+    ".ts",
+    ".wmv",
+}
+
+# bytes read from each of the head, middle and tail of a file for partial hashes
+SAMPLE_SIZE = 64 * 1024
+
+# anything smaller is a sample or extra rather than a copy of a film
+MIN_SIZE = 50 * 1024 * 1024
+
+
+class ShareFile(TypedDict):
+    share: str
+    path: str
+    size: int
+
+
+class _HashWriter:
+    """File-like object that hashes whatever pysmb writes to it."""
+
+    def __init__(self):
+        self.hash = hashlib.blake2b()
+
+    def write(self, data: bytes):
+        self.hash.update(data)
+        return len(data)
+
+
+class _Connections:
+    """One SMB connection per worker thread; pysmb connections aren't thread-safe.
+
+    Connections live as long as their thread, so share one executor between the
+    scan stages rather than logging in again for each stage's threads.
+    """
+
+    def __init__(self, connect: Callable[[], Any]):
+        self._connect = connect
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._all: List[Any] = []
+
+    def get(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            with self._lock:
+                self._all.append(conn)
+        return conn
+
+    def close(self):
+        for conn in self._all:
+            conn.close()
+
+
+def walk_share(
+    conn,
+    share: str,
+    min_size: int = MIN_SIZE,
+    skipped: Optional[List[str]] = None,
+) -> List[ShareFile]:
+    """List every video file on ``share`` of at least ``min_size`` bytes.
+
+    Directories that can't be listed are left out, and added to ``skipped``.
+    """
+    found: List[ShareFile] = []
+    dirs = ["/"]
+    while dirs:
+        directory = dirs.pop()
+        try:
+            listing = conn.listPath(share, directory)
+        except Exception as e:
+            print(f"Skipping {share}:{directory}: {e!r}")
+            if skipped is not None:
+                skipped.append(f"{share}:{directory}")
+            continue
+        for f in listing:
+            if f.filename in (".", ".."):
+                continue
+            path = f"{directory.rstrip('/')}/{f.filename}"
+            if f.isDirectory:
+                dirs.append(path)
+            elif (
+                f.file_size >= min_size
+                and f.filename[f.filename.rfind(".") :].lower() in VIDEO_EXTENSIONS
+            ):
+                found.append({"share": share, "path": path, "size": f.file_size})
+    return found
+
+
+def scan_shares(
+    connections: _Connections,
+    shares: Iterable[str],
+    pool: Executor,
+    min_size: int = MIN_SIZE,
+    skipped: Optional[List[str]] = None,
+) -> List[ShareFile]:
+    """Walk the shares concurrently on ``pool``."""
+
+    def _walk(share):
+        return walk_share(connections.get(), share, min_size, skipped)
+
+    return [f for files in pool.map(_walk, shares) for f in files]
+
+
+def partial_hash(conn, f: ShareFile, sample_size: int = SAMPLE_SIZE) -> str:
+    """Hash the size plus ``sample_size`` bytes from the head, middle and tail."""
+    writer = _HashWriter()
+    writer.write(str(f["size"]).encode())
+    offsets = {0, max(f["size"] // 2 - sample_size // 2, 0)}
+    offsets.add(max(f["size"] - sample_size, 0))
+    for offset in sorted(offsets):
+        conn.retrieveFileFromOffset(f["share"], f["path"], writer, offset, sample_size)
+    return writer.hash.hexdigest()
+
+
+def full_hash(conn, f: ShareFile) -> str:
+    writer = _HashWriter()
+    conn.retrieveFile(f["share"], f["path"], writer)
+    return writer.hash.hexdigest()
+
+
+def _refine(
+    groups: Iterable[List[ShareFile]],
+    hasher: Callable[[ShareFile], str],
+    pool: Executor,
+    skipped: Optional[List[str]] = None,
+) -> List[List[ShareFile]]:
+    """Split each group by hash, keeping only sub-groups with more than one file.
+
+    Files that can't be read (deleted or locked since the walk, say) are dropped
+    from their group and added to ``skipped``.
+    """
+
+    def _hash(f: ShareFile) -> Optional[str]:
+        try:
+            return hasher(f)
+        except Exception as e:
+            print(f"Skipping {f['share']}:{f['path']}: {e!r}")
+            return None
+
+    groups = list(groups)
+    files = [f for group in groups for f in group]
+    hashes = dict(zip(map(id, files), pool.map(_hash, files)))
+    if skipped is not None:
+        skipped.extend(
+            f"{f['share']}:{f['path']}" for f in files if hashes[id(f)] is None
+        )
+
+    refined = []
+    for group in groups:
+        by_hash: Dict[str, List[ShareFile]] = defaultdict(list)
+        for f in group:
+            if hashes[id(f)] is not None:
+                by_hash[hashes[id(f)]].append(f)
+        refined.extend(g for g in by_hash.values() if len(g) > 1)
+    return refined
+
+
+def find_duplicates(
+    connections: _Connections,
+    files: Sequence[ShareFile],
+    pool: Executor,
+    sample_size: int = SAMPLE_SIZE,
+    confirm: bool = True,
+    skipped: Optional[List[str]] = None,
+) -> List[List[ShareFile]]:
+    """Group files with identical contents.
+
+    Files are grouped by size first, which is free.  Only same-size files are
+    sampled with ranged reads, and only files whose samples match are read in full
+    (unless ``confirm`` is off, in which case matching samples are trusted).
+    Files that can't be read are left out of the groups and added to ``skipped``.
+    """
+    by_size: Dict[int, List[ShareFile]] = defaultdict(list)
+    for f in files:
+        by_size[f["size"]].append(f)
+    candidates = [g for g in by_size.values() if len(g) > 1]
+
+    candidates = _refine(
+        candidates,
+        lambda f: partial_hash(connections.get(), f, sample_size),
+        pool,
+        skipped,
+    )
+
+    if confirm:
+        # small enough that the samples covered the whole file
+        sampled = [g for g in candidates if g[0]["size"] <= 3 * sample_size]
+        to_confirm = [g for g in candidates if g[0]["size"] > 3 * sample_size]
+        candidates = sampled + _refine(
+            to_confirm, lambda f: full_hash(connections.get(), f), pool, skipped
+        )
+
+    return candidates
+
+
+def radarr_file_paths(
+    movies: Iterable[Mapping[str, Any]], path_share_map: Mapping[str, str]
+) -> Set[Tuple[str, str]]:
+    """(share, casefolded path) of every file Radarr knows about.
+
+    Movies without a file, or outside the scanned shares, are left out:
+
+    >>> def movie(path, relative_path=None):
+    ...     return {"path": path, "movieFile": {"relativePath": relative_path}}
+    >>> movies = [
+    ...     movie("/tank2/Media/Heat (1995)", "Heat.mkv"),
+    ...     movie("/tank2/Media/Ran (1985)"),
+    ...     {"path": "/tank2/Media/Brazil (1985)"},
+    ...     movie("/elsewhere/Alien (1979)", "Alien.mkv"),
+    ... ]
+    >>> radarr_file_paths(movies, PATH_SHARE_MAP)
+    {('Media2', '/heat (1995)/heat.mkv')}
+    """
+    known = set()
+    for movie in movies:
+        relative_path = get_by_path(movie, ["movieFile", "relativePath"])
+        if not relative_path or not movie.get("path"):
+            continue
+        try:
+            share, path = share_path(f"{movie['path']}/{relative_path}", path_share_map)
+        except ValueError:
+            # not on one of the shares we scan
+            continue
+        known.add((share, path.casefold()))
+    return known
+
+
+def _key(f: ShareFile) -> Tuple[str, str]:
+    return f["share"], f["path"].casefold()
+
+
+def print_report(
+    duplicates: Sequence[Sequence[ShareFile]],
+    orphans: Sequence[ShareFile],
+    known: Set[Tuple[str, str]],
+    skipped: Sequence[str] = (),
+):
+    reclaimable = 0
+    print(f"{len(duplicates)} sets of duplicates")
+    for group in sorted(duplicates, key=lambda g: g[0]["size"], reverse=True):
+        size = group[0]["size"]
+        reclaimable += size * (len(group) - 1)
+        print(f"\n  {humanbytes_storage(size)} x {len(group)}")
+        for f in group:
+            marker = "radarr" if _key(f) in known else "      "
+            print(f"    [{marker}] {f['share']}:{f['path']}")
+
+    orphan_bytes = sum(f["size"] for f in orphans)
+    print(f"\n{len(orphans)} files not in Radarr ({humanbytes_storage(orphan_bytes)})")
+    for f in sorted(orphans, key=lambda f: f["size"], reverse=True):
+        print(f"  {humanbytes_storage(f['size']):>10}  {f['share']}:{f['path']}")
+
+    print(f"\nReclaimable from duplicates: {humanbytes_storage(reclaimable)}")
+
+    if skipped:
+        print(f"\n{len(skipped)} unreadable directories and files skipped")
+        for entry in sorted(skipped):
+            print(f"  {entry}")
+
+
+def scan(
+    smb_user: str,
+    smb_password: str,
+    smb_server_name: str,
+    smb_server_ip: str,
+    path_share_map: Optional[Mapping[str, str]] = None,
+    sample_size: int = SAMPLE_SIZE,
+    confirm: bool = True,
+    max_workers: int = 4,
+):
+    """Report duplicate films across the shares and files Radarr doesn't know.
+
+    At most ``max_workers`` SMB connections are opened, shared by the share walk
+    and both hashing stages.
+    """
+    if path_share_map is None:
+        path_share_map = PATH_SHARE_MAP
+
+    skipped: List[str] = []
+    connections = _Connections(
+        lambda: smb_connect(smb_user, smb_password, smb_server_name, smb_server_ip)
+    )
+    with closing(connections), ThreadPoolExecutor(max_workers) as pool:
+        with ThreadPoolExecutor(max_workers=1) as radarr_pool:
+            # Fetch the library while the shares are being walked.  Run it in a
+            # copy of this context so it asks the same instance we were called
+            # with (see use_instance).
+            movies = radarr_pool.submit(contextvars.copy_context().run, get_movies)
+            files = scan_shares(
+                connections, set(path_share_map.values()), pool, skipped=skipped
+            )
+            known = radarr_file_paths(movies.result(), path_share_map)
+
+        total = humanbytes_storage(sum(f["size"] for f in files))
+        print(f"Found {len(files)} video files, {total}")
+        duplicates = find_duplicates(
+            connections, files, pool, sample_size, confirm, skipped
+        )
+
+    orphans = [f for f in files if _key(f) not in known]
+    print_report(duplicates, orphans, known, skipped)
@@ -0,0 +1,248 @@
+"""Background writer for moviefile edits made in the review GUI.
+
+The examples below swap Radarr for a stub transport.  Its requests block until
+``release`` is set, which holds the writer on the first edit while later ones
+queue up behind it.
+
+>>> import threading
+>>> from radarrapi import set_transport
+>>> class Response:
+...     def __init__(self, status_code, data):
+...         self.status_code, self.data = status_code, data
+...     def json(self):
+...         return self.data
+...     def raise_for_status(self):
+...         if self.status_code >= 400:
+...             raise RuntimeError(self.status_code)
+>>> class Stub:
+...     def __init__(self):
+...         self.release = threading.Event()
+...         self.puts = []
+...         self.status = 200
+...     def http(self, instance, method, path, kwargs, send):
+...         self.release.wait()
+...         if method == "GET":
+...             id_ = int(path.rsplit("/", 1)[1])
+...             quality = {"quality": {"name": "Unknown"}, "customFormats": []}
+...             return Response(200, {"id": id_, "quality": quality})
+...         self.puts.append(kwargs["json"])
+...         return Response(self.status, {"message": "nope"})
+>>> stub = Stub()
+>>> set_transport(stub)
+
+Edits to the same moviefile made before the writer gets to it are merged into a
+single PUT:
+
+>>> queue = MovieFileEditQueue()
+>>> queue.enqueue(1, "First", quality={"name": "Bluray-1080p"})
+>>> queue.enqueue(2, "Second", quality={"name": "Bluray-1080p"})
+>>> queue.enqueue(2, "Second", custom_formats=[{"name": "Complex Surround"}])
+>>> queue.pending_count
+2
+>>> stub.release.set()
+>>> queue.flush(timeout=5)
+Updating quality on First from Unknown to Bluray-1080p
+Updating quality on Second from Unknown to Bluray-1080p
+Updating custom formats on Second from [] to ['Complex Surround']
+True
+>>> [put["id"] for put in stub.puts]
+[1, 2]
+
+An error status from Radarr counts as a failed write, which can be retried:
+
+>>> stub.status = 500
+>>> queue.enqueue(3, "Third", quality={"name": "Bluray-1080p"})
+>>> queue.flush(timeout=5)
+Updating quality on Third from Unknown to Bluray-1080p
+True
+>>> queue.failed
+[('Third', 'RuntimeError(500)')]
+>>> queue.status_text()
+'Pending writes: 0  Failed writes: 1'
+>>> stub.status = 200
+>>> queue.retry_failed()
+>>> queue.close(timeout=5)
+Updating quality on Third from Unknown to Bluray-1080p
+True
+>>> queue.failed
+[]
+>>> set_transport(None)
+"""
+import contextvars
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, MutableMapping, Optional, Sequence, Tuple
+
+from radarrapi import MOVIEFILE_PATH, CustomFormat, QualityType, _put, get_moviefile
+from utils import get_by_path
+
+
+class MovieFileEditQueue:
+    """Apply moviefile quality/custom format edits on a background thread.
+
+    Edits are keyed by moviefile id.  Enqueueing another edit for a moviefile that
+    hasn't been written yet is merged into the pending edit, so a file is only
+    fetched and PUT once no matter how many times it's changed before the worker
+    gets to it.  Quality and custom formats are written together in a single PUT.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._in_flight: Optional[Dict[str, Any]] = None
+        self._failed: Dict[int, Tuple[Dict[str, Any], str]] = {}
+        self._closed = False
+        # run in a copy of the creating context so the writer talks to the same
+        # Radarr instance as whoever created the queue
+        self._thread = threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(self._run,),
+            name="moviefile-writer",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def enqueue(
+        self,
+        moviefile_id: int,
+        title: str,
+        quality: Optional[QualityType] = None,
+        custom_formats: Optional[Sequence[CustomFormat]] = None,
+    ):
+        """Queue an edit.  ``None`` means "leave this part of the file alone"."""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Edit queue has been closed.")
+            edit = self._pending.get(moviefile_id) or {
+                "title": title,
+                "quality": None,
+                "custom_formats": None,
+            }
+            if quality is not None:
+                edit["quality"] = quality
+            if custom_formats is not None:
+                edit["custom_formats"] = list(custom_formats)
+            self._pending[moviefile_id] = edit
+            # a fresh edit supersedes whatever failed before
+            self._failed.pop(moviefile_id, None)
+            self._cond.notify_all()
+
+    @property
+    def pending_count(self) -> int:
+        with self._cond:
+            return len(self._pending) + (self._in_flight is not None)
+
+    @property
+    def pending_titles(self) -> List[str]:
+        """Titles of edits that haven't been written yet."""
+        with self._cond:
+            edits = list(self._pending.values())
+            if self._in_flight is not None:
+                edits.insert(0, self._in_flight)
+            return [edit["title"] for edit in edits]
+
+    @property
+    def failed(self) -> List[Tuple[str, str]]:
+        """(title, error) for each edit that could not be written."""
+        with self._cond:
+            return [(edit["title"], err) for edit, err in self._failed.values()]
+
+    def status_text(self) -> str:
+        pending = self.pending_count
+        failed = len(self.failed)
+        if not pending and not failed:
+            return "All changes saved."
+        return f"Pending writes: {pending}  Failed writes: {failed}"
+
+    def retry_failed(self):
+        """Queue every failed edit again."""
+        with self._cond:
+            failed, self._failed = self._failed, {}
+        for moviefile_id, (edit, _) in failed.items():
+            self.enqueue(
+                moviefile_id, edit["title"], edit["quality"], edit["custom_formats"]
+            )
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait for queued edits to be written (or fail).
+
+        Returns ``True`` if the queue drained within ``timeout``.
+        """
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._pending and self._in_flight is None, timeout
+            )
+
+    def close(self, timeout: Optional[float] = None) -> bool:
+        """Stop accepting edits and wait up to ``timeout`` for queued ones.
+
+        Returns ``True`` if everything queued was written (or failed) in time.
+        Anything still pending after that is abandoned along with the daemon
+        writer thread when the interpreter exits.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                moviefile_id, edit = self._pending.popitem(last=False)
+                self._in_flight = edit
+            try:
+                self._apply(moviefile_id, edit)
+            except Exception as e:
+                with self._cond:
+                    # only record the failure if nothing newer was queued meanwhile
+                    if moviefile_id not in self._pending:
+                        self._failed[moviefile_id] = (edit, repr(e))
+            finally:
+                with self._cond:
+                    self._in_flight = None
+                    self._cond.notify_all()
+
+    @staticmethod
+    def _apply(moviefile_id: int, edit: MutableMapping[str, Any]):
+        # refresh the moviefile data from Radarr because I'm not sure if the
+        # moviefile data we got from the "/movie" endpoint is the same format as
+        # the data we have to post to the "/moviefile" endpoint.
+        movie_file = get_moviefile(moviefile_id)
+
+        refreshed_quality_name = get_by_path(movie_file, ["quality", "quality", "name"])
+        refreshed_custom_formats_names = sorted(
+            [
+                cf["name"]
+                for cf in get_by_path(movie_file, ["quality", "customFormats"], [])
+            ]
+        )
+
+        changed = False
+        quality = edit["quality"]
+        if quality is not None and quality["name"] != refreshed_quality_name:
+            print(
+                f"Updating quality on {edit['title']} from {refreshed_quality_name} "
+                f"to {quality['name']}"
+            )
+            movie_file["quality"]["quality"] = quality
+            changed = True
+
+        custom_formats = edit["custom_formats"]
+        if custom_formats is not None:
+            names = sorted(cf["name"] for cf in custom_formats)
+            if names != refreshed_custom_formats_names:
+                print(
+                    f"Updating custom formats on {edit['title']} from "
+                    f"{refreshed_custom_formats_names} to {names}"
+                )
+                movie_file["quality"]["customFormats"] = list(custom_formats)
+                changed = True
+
+        if changed:
+            # unlike update_moviefile, make an error response count as a failure
+            _put(MOVIEFILE_PATH, movie_file).raise_for_status()
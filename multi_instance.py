@@ -0,0 +1,180 @@
+"""Run radarrapi functions against several Radarr instances at once.
+
+With a stub transport standing in for two servers, one of which is down:
+
+>>> from radarrapi import get_movies_for_profile, set_transport
+>>> class Response:
+...     def __init__(self, data):
+...         self.data = data
+...     def json(self):
+...         return self.data
+>>> def movie(tmdb_id, profile_id):
+...     return {"tmdbId": tmdb_id, "qualityProfileId": profile_id}
+>>> LIBRARIES = {"hd": [movie(1, 1), movie(2, 2)], "uhd": [movie(2, 1), movie(3, 1)]}
+>>> class Stub:
+...     def http(self, instance, method, path, kwargs, send):
+...         if instance.name not in LIBRARIES:
+...             raise ConnectionError(instance.name)
+...         return Response(LIBRARIES[instance.name])
+>>> set_transport(Stub())
+>>> instances = [RadarrInstance(n, f"http://{n}/api", "key") for n in LIBRARIES]
+>>> instances.append(RadarrInstance("old", "http://old/api", "key"))
+
+Each instance gets its own call, and generators are consumed against the right
+server:
+
+>>> results = run_on_instances(instances, get_movies_for_profile, 1)
+>>> [[m["tmdbId"] for m in results[name]["result"]] for name in ("hd", "uhd")]
+[[1], [2, 3]]
+
+A server that fails doesn't stop the others.  Its error is kept, and no
+half-consumed generator is left behind as its result:
+
+>>> results["old"]["result"], results["old"]["error"]
+(None, ConnectionError('old'))
+
+Merging libraries skips failed instances:
+
+>>> merged = merge_libraries(run_on_instances(instances, get_movies))
+>>> {tmdb_id: sorted(movies) for tmdb_id, movies in sorted(merged.items())}
+{1: ['hd'], 2: ['hd', 'uhd'], 3: ['uhd']}
+>>> set_transport(None)
+"""
+import inspect
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    TypedDict,
+)
+
+from radarrapi import RadarrInstance, get_movies, use_instance
+
+
+class InstanceResult(TypedDict):
+    instance: str
+    result: Any
+    error: Optional[BaseException]
+    elapsed: float
+
+
+def load_instances(path: str) -> List[RadarrInstance]:
+    """Read instances from a JSON file.
+
+    The file holds a list of objects with ``name``, ``base_url`` and ``api_key``
+    keys, e.g. one entry for the 1080p server and one for the 4K server.
+    """
+    with open(path) as f:
+        config = json.load(f)
+
+    names = [c["name"] for c in config]
+    assert len(set(names)) == len(names), "Instance names must be unique."
+
+    return [RadarrInstance(c["name"], c["base_url"], c["api_key"]) for c in config]
+
+
+def run_on_instances(
+    instances: Sequence[RadarrInstance],
+    func: Callable[..., Any],
+    *args,
+    max_workers: Optional[int] = None,
+    **kwargs,
+) -> Dict[str, InstanceResult]:
+    """Call ``func(*args, **kwargs)`` once per instance, concurrently.
+
+    ``func`` can be any of the radarrapi functions (or a job built out of them);
+    each call runs with its instance made current.  Generators, like
+    `get_movies_for_profile`, are consumed into a list while their instance is
+    still current.  Exceptions are captured per instance rather than raised so one
+    unreachable server doesn't sink the rest.
+    """
+
+    def _run(instance: RadarrInstance) -> InstanceResult:
+        start = time.perf_counter()
+        result = error = None
+        with use_instance(instance):
+            try:
+                result = func(*args, **kwargs)
+                if inspect.isgenerator(result):
+                    result = list(result)
+            except Exception as e:
+                # don't hand back a half-consumed generator alongside the error
+                result, error = None, e
+        return {
+            "instance": instance.name,
+            "result": result,
+            "error": error,
+            "elapsed": time.perf_counter() - start,
+        }
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(instances) or 1) as pool:
+        results = list(pool.map(_run, instances))
+
+    return {r["instance"]: r for r in results}
+
+
+def merge_libraries(
+    results: Mapping[str, InstanceResult]
+) -> Dict[int, Dict[str, Mapping[str, Any]]]:
+    """Merge per-instance movie lists into {tmdbId: {instance name: movie}}."""
+    merged: Dict[int, Dict[str, Mapping[str, Any]]] = {}
+    for name, result in results.items():
+        if result["error"] is not None:
+            continue
+        for movie in result["result"]:
+            merged.setdefault(movie["tmdbId"], {})[name] = movie
+    return merged
+
+
+def get_merged_library(
+    instances: Sequence[RadarrInstance],
+) -> Dict[int, Dict[str, Mapping[str, Any]]]:
+    results = run_on_instances(instances, get_movies)
+    print_timings(results)
+    return merge_libraries(results)
+
+
+def print_timings(results: Mapping[str, InstanceResult]):
+    for name, result in results.items():
+        status = "ok" if result["error"] is None else f"FAILED ({result['error']!r})"
+        print(f"{name}: {result['elapsed']:.2f}s {status}")
+
+
+def compare_instances(path: str):
+    """Summarise which movies are on which of the instances in the config file.
+
+    Instances that can't be reached are left out of the comparison, so "on all
+    instances" means all of the ones that answered.
+    """
+    instances = load_instances(path)
+    results = run_on_instances(instances, get_movies)
+    print_timings(results)
+
+    names = [name for name, result in results.items() if result["error"] is None]
+    failed = len(results) - len(names)
+    if not names:
+        print("No instances could be reached.")
+        return
+    library = merge_libraries(results)
+
+    print(f"{len(library)} distinct movies across {len(names)} instances")
+    if failed:
+        print(f"  ({failed} unreachable instances left out)")
+    print(f"  on all instances: {sum(len(m) == len(names) for m in library.values())}")
+    for name in names:
+        only = sum(list(m.keys()) == [name] for m in library.values())
+        print(f"  only on {name}: {only}")
+
+
+if __name__ == "__main__":
+    from radarrutils import main
+
+    main(["compare-instances", *sys.argv[1:]])
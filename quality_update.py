@@ -1,20 +1,23 @@
-import argparse
+import sys
 from contextlib import closing
 from pathlib import Path
 from pprint import pprint
 
+from edit_queue import MovieFileEditQueue
 from radarrapi import (
+    PATH_SHARE_MAP,
     find_data_from_smb_nfo,
     get_custom_formats,
     get_movies_for_downloaded_quality,
     get_qualities,
-    get_moviefile,
-    set_quality,
-    set_custom_formats,
 )
 from utils import humanbytes_storage, get_by_path
 
 UNKNOWN_QUALITY = "Unknown"
+RETRY_FAILED = "Retry failed"
+
+# seconds to wait for queued edits when the window closes
+FLUSH_TIMEOUT = 60
 
 
 def get_unknown_quality_movies():
@@ -24,13 +27,6 @@ def get_unknown_quality_movies():
 def get_movie_data(
     smb_user: str, smb_password: str, smb_server_name: str, smb_server_ip: str,
 ):
-    path_share_map = {
-        "/tank1/Media": "Media",
-        "/tank2/Media": "Media2",
-        "/tank3/Media": "Media3",
-        "/tank4/Media": "Media4",
-    }
-
     for movie in get_unknown_quality_movies():
         nfo_lines = find_data_from_smb_nfo(
             movie,
@@ -38,7 +34,7 @@ def get_movie_data(
             smb_password,
             smb_server_name,
             smb_server_ip,
-            path_share_map,
+            PATH_SHARE_MAP,
         )
 
         yield movie, nfo_lines
@@ -106,31 +102,23 @@ def update_window(
     )
 
 
-if __name__ == "__main__":
+def review_unknowns(
+    smb_user: str, smb_password: str, smb_server_name: str, smb_server_ip: str,
+):
+    """Step through unknown-quality movies in a GUI and pick their quality."""
     import PySimpleGUI as sg
 
-    parser = argparse.ArgumentParser(
-        description="Update radarr file qualties for " "unknown quality files."
-    )
-
-    parser.add_argument("--smb-user", "-su", required=True, help="Username for SMB")
-    parser.add_argument("--smb-pass", "-sp", required=True, help="Password for SMB")
-    parser.add_argument(
-        "--smb-server-name", "-sn", required=True, help="SMB server name."
-    )
-    parser.add_argument("--smb-server-ip", "-si", required=True, help="SMB server IP.")
-    args = parser.parse_args()
-
     qualities = get_qualities()
     qualities_by_name = {q["quality"]["name"]: q["quality"] for q in qualities}
     custom_formats = get_custom_formats()
     # custom_formats_by_name = {cf["name"]: cf for cf in custom_formats}
 
     movies = list(
-        get_movie_data(
-            args.smb_user, args.smb_pass, args.smb_server_name, args.smb_server_ip
-        )
+        get_movie_data(smb_user, smb_password, smb_server_name, smb_server_ip)
     )
+    if not movies:
+        print("No unknown quality movies.")
+        return
 
     idx = 0
     movie, nfo_lines = movies[idx]
@@ -213,124 +201,112 @@ if __name__ == "__main__":
                 ]
             ),
         ],
-        [sg.Ok("Next")],
+        [
+            sg.Ok("Next"),
+            sg.Button(RETRY_FAILED),
+            sg.Text("", key="__WRITE_STATUS__", size=(60, 1)),
+        ],
     ]
     print(custom_format_names)
     print(quality_names)
-    with closing(sg.Window("Unknowns updater", layout)) as window:
-        window.finalize()
+    edit_queue = MovieFileEditQueue()
+    try:
+        with closing(sg.Window("Unknowns updater", layout)) as window:
+            window.finalize()
+
+            # populate window with initial values
+            update_window(
+                window,
+                movie,
+                nfo_lines,
+                idx,
+                len(movies),
+                quality_names,
+                custom_format_names,
+            )
 
-        # populate window with initial values
-        update_window(
-            window,
-            movie,
-            nfo_lines,
-            idx,
-            len(movies),
-            quality_names,
-            custom_format_names,
-        )
+            while True:
+                # get the quality data for currently-displayed movie
+                current_quality_name = get_by_path(
+                    movie, ["movieFile", "quality", "quality", "name"]
+                )
+                current_formats_names = sorted(
+                    [
+                        cf["name"]
+                        for cf in get_by_path(
+                            movie, ["movieFile", "quality", "customFormats"], default=[]
+                        )
+                    ]
+                )
+                # wake up periodically so the write status stays current
+                event, values = window.read(timeout=500)
 
-        while True:
-            # get the quality data for currently-displayed movie
-            current_quality_name = get_by_path(
-                movie, ["movieFile", "quality", "quality", "name"]
-            )
-            current_formats_names = sorted(
-                [
-                    cf["name"]
-                    for cf in get_by_path(
-                        movie, ["movieFile", "quality", "customFormats"], default=[]
-                    )
-                ]
-            )
-            event, values = window.read()
-
-            if event in (None, "Exit"):
-                break
-
-            if event == "Next":
-                idx += 1
-
-                # get the quality data selected in the GUI
-                selected_quality_name = values.get("__QUAL__", [None])[0]
-                selected_formats_names = sorted(values.get("__FMT__", []))
-
-                # check if the quality of the movie doesn't equal the quality
-                # selected in the GUI
-                if (
-                    selected_quality_name != current_quality_name
-                    or selected_formats_names != current_formats_names
-                ) and (
-                    selected_quality_name != NO_CHANGE
-                    and current_formats_names != [NO_CHANGE]
-                ):
-                    print("Getting moviefile")
-                    # refresh the moviefile data from Radarr because I'm not sure if
-                    # the  moviefile data we got from the "/movie" endpoint is the
-                    # same format as the data we have to post to the "/moviefile"
-                    # endpoint.
-                    movie_file = get_moviefile(movie["movieFile"]["id"])
-
-                    # ...and pull out the name of the quality.  We'll use the name to
-                    # look up the actual quality data later.
-                    refreshed_quality_name = get_by_path(
-                        movie_file, ["quality", "quality", "name"]
-                    )
+                if event in (None, "Exit"):
+                    break
 
-                    # ...and pull out the list of custom format dicts.  Remember
-                    # that there are multiple selectable custom formats per moviefile.
-                    refreshed_custom_formats_names = sorted(
-                        [
-                            cf["name"]
-                            for cf in get_by_path(
-                                movie_file, ["quality", "customFormats"], default=[]
-                            )
-                        ]
-                    )
+                if event == RETRY_FAILED:
+                    edit_queue.retry_failed()
 
-                    # and again check if the selected quality matches the moviefile
-                    # quality
-                    updated_quality_data = None
-                    updated_format_data = None
-                    if (
-                        selected_quality_name != refreshed_quality_name
-                        and selected_quality_name != NO_CHANGE
-                    ):
-                        # GUI-selected quality does not match moviefile quality
-                        updated_quality_data = qualities_by_name[selected_quality_name]
+                update_key(window, "WRITE_STATUS", edit_queue.status_text())
+
+                if event == "Next":
+                    # get the quality data selected in the GUI
+                    selected_quality_name = values.get("__QUAL__", [None])[0]
+                    selected_formats_names = sorted(values.get("__FMT__", []))
+
+                    # check if the quality of the movie doesn't equal the quality
+                    # selected in the GUI
                     if (
-                        selected_formats_names != refreshed_custom_formats_names
-                        and selected_formats_names != [NO_CHANGE]
+                        selected_quality_name != current_quality_name
+                        or selected_formats_names != current_formats_names
+                    ) and (
+                        selected_quality_name != NO_CHANGE
+                        and current_formats_names != [NO_CHANGE]
                     ):
-                        # GUI-selected custom formats names does not match moviefile
-                        # qualities
-                        updated_format_data = [
-                            custom_formats[name] for name in selected_formats_names
-                        ]
-
-                    if updated_quality_data:
-                        print(
-                            f"Updating quality on  {movie['title']} from"
-                            f" {refreshed_quality_name} "
-                            f"to {selected_quality_name}"
-                        )
-                        set_quality(updated_quality_data, movie_file)
-                    if updated_format_data:
-                        print(
-                            f"Updating custom formats on {movie['title']} from "
-                            f"{refreshed_custom_formats_names} to "
-                            f"{selected_formats_names}"
+                        # hand the edit off to the writer thread so we don't sit on the
+                        # round trips to Radarr before showing the next movie.  The
+                        # writer re-checks against the moviefile's current data.
+                        edit_queue.enqueue(
+                            movie["movieFile"]["id"],
+                            movie["title"],
+                            quality=qualities_by_name[selected_quality_name],
+                            custom_formats=(
+                                [
+                                    custom_formats[name]
+                                    for name in selected_formats_names
+                                ]
+                                if selected_formats_names != [NO_CHANGE]
+                                else None
+                            ),
                         )
-                        set_custom_formats(updated_format_data, movie_file)
-
-                movie, nfo_lines = movies[idx]
-                update_window(
-                    window,
-                    movie,
-                    nfo_lines,
-                    idx,
-                    len(movies),
-                    quality_names,
-                    custom_format_names,
-                )
+
+                    if idx + 1 == len(movies):
+                        update_key(window, "PROGRESS", "Last movie")
+                        continue
+
+                    idx += 1
+                    movie, nfo_lines = movies[idx]
+                    update_window(
+                        window,
+                        movie,
+                        nfo_lines,
+                        idx,
+                        len(movies),
+                        quality_names,
+                        custom_format_names,
+                    )
+    finally:
+        # Whatever ended the loop, don't drop edits that are still queued.
+        if edit_queue.pending_count:
+            print(f"Waiting for {edit_queue.pending_count} pending writes...")
+        if not edit_queue.close(timeout=FLUSH_TIMEOUT):
+            for title in edit_queue.pending_titles:
+                print(f"Gave up waiting to update {title}")
+        for title, error in edit_queue.failed:
+            print(f"Failed to update {title}: {error}")
+
+
+if __name__ == "__main__":
+    from radarrutils import main
+
+    main(["review-gui", *sys.argv[1:]])
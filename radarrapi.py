@@ -3,29 +3,34 @@ import os
 import platform
 import re
 import socket
-from contextlib import closing
+import sys
+import threading
+from contextlib import closing, contextmanager
+from contextvars import ContextVar
 from datetime import datetime, timedelta, timezone
 from pprint import pprint
 from time import sleep
 from typing import (
     Any,
+    Iterable,
     List,
     Mapping,
     MutableMapping,
     Optional,
     Pattern,
     Sequence,
+    Tuple,
+    TYPE_CHECKING,
     TypedDict,
     Union,
 )
 
-import requests
-from dateutil import parser
-
 from utils import get_by_path
 
+if TYPE_CHECKING:
+    import requests
+
 API_KEY = "API KEY HERE"
-BASE_QUERY = {"apikey": API_KEY}
 
 BASE_URL = f"https://raneus.thewyattshouse.com:32913/api"
 PROFILE_PATH = "/profile"
@@ -34,9 +39,112 @@ COMMAND_PATH = "/command"
 QUALITY_PATH = "/qualitydefinition"
 CUSTOM_FORMAT_PATH = "/customformat"
 MOVIEFILE_PATH = "/moviefile"
+MOVIE_EDITOR_PATH = "/movie/editor"
+
+# movies per bulk movie editor request
+BULK_EDIT_CHUNK_SIZE = 250
+
+# Replies to a bulk edit meaning "no such endpoint" rather than "request failed".
+# A 400 is a v3 validation error (e.g. an unknown profile id), so it's raised.
+MOVIE_EDITOR_MISSING_STATUSES = {404, 405}
+
+# Radarr path prefix -> SMB share it lives on
+PATH_SHARE_MAP = {
+    "/tank1/Media": "Media",
+    "/tank2/Media": "Media2",
+    "/tank3/Media": "Media3",
+    "/tank4/Media": "Media4",
+}
 
 client_machine_name = None
 
+# Set with `set_transport` to capture or replay Radarr/SMB traffic (see recording.py)
+_transport = None
+
+
+class RadarrInstance:
+    """Connection details for one Radarr server.
+
+    The module-level API functions talk to whichever instance is current in the
+    calling thread (see `use_instance`), which is `DEFAULT_INSTANCE` unless told
+    otherwise.
+    """
+
+    def __init__(self, name: str, base_url: str, api_key: str):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        # requests' Session isn't guaranteed thread-safe, so one per thread
+        self._local = threading.local()
+        # whether the server has the bulk movie editor; None until we've tried it
+        self.supports_movie_editor: Optional[bool] = None
+
+    def __repr__(self):
+        return f"RadarrInstance({self.name!r}, {self.base_url!r})"
+
+    @property
+    def session(self) -> "requests.Session":
+        session = getattr(self._local, "session", None)
+        if session is None:
+            import requests
+
+            session = self._local.session = requests.Session()
+        return session
+
+    def request(self, method: str, path: str, **kwargs) -> "requests.Response":
+        if _transport is not None:
+            return _transport.http(self, method, path, kwargs, self.send)
+        return self.send(method, path, **kwargs)
+
+    def send(self, method: str, path: str, **kwargs) -> "requests.Response":
+        """Make the request over the network, bypassing any transport."""
+        params = {"apikey": self.api_key, **kwargs.pop("params", {})}
+        return self.session.request(
+            method, self.base_url + path, params=params, **kwargs
+        )
+
+
+DEFAULT_INSTANCE = RadarrInstance("default", BASE_URL, API_KEY)
+
+_current_instance: ContextVar[RadarrInstance] = ContextVar(
+    "radarr_instance", default=DEFAULT_INSTANCE
+)
+
+
+def current_instance() -> RadarrInstance:
+    return _current_instance.get()
+
+
+def set_transport(transport):
+    """Send Radarr requests and SMB connections through ``transport``.
+
+    ``transport.http(instance, method, path, kwargs, send)`` is called for every
+    API request and ``transport.smb(connect)`` whenever an SMB connection is
+    needed; ``send`` and ``connect`` do the real work.  ``None`` goes back to
+    talking to the servers directly.
+    """
+    global _transport
+    _transport = transport
+
+
+@contextmanager
+def use_instance(instance: RadarrInstance):
+    """Route API calls made inside the block to ``instance``.
+
+    This only applies to the current thread.  New threads and executor workers
+    don't inherit it; they start out on `DEFAULT_INSTANCE`.  Work handed to another
+    thread has to carry the instance along, either by running the target with
+    ``contextvars.copy_context().run`` (as `MovieFileEditQueue` and `dupes.scan`
+    do) or by calling `use_instance` again in the worker (as
+    `multi_instance.run_on_instances` does).  Generators run in whatever context
+    consumes them, so consume them inside the block.
+    """
+    token = _current_instance.set(instance)
+    try:
+        yield instance
+    finally:
+        _current_instance.reset(token)
+
 
 class QualityType(TypedDict):
     id: int
@@ -103,11 +211,15 @@ def set_custom_formats(
 
 
 def _get(path: str):
-    return requests.get(BASE_URL + path, params=BASE_QUERY)
+    return current_instance().request("GET", path)
 
 
 def _put(path: str, data: Any):
-    return requests.put(BASE_URL + path, params=BASE_QUERY, json=data)
+    return current_instance().request("PUT", path, json=data)
+
+
+def _post(path: str, data: Any):
+    return current_instance().request("POST", path, json=data)
 
 
 def get_moviefile(id_: int):
@@ -124,6 +236,137 @@ def set_profile(movie: MutableMapping[str, Any], profile_id: int):
     return update_movie(movie)
 
 
+def set_profiles(
+    movies: Iterable[MutableMapping[str, Any]],
+    profile_id: int,
+    chunk_size: int = BULK_EDIT_CHUNK_SIZE,
+):
+    """Set the profile of many movies, ``chunk_size`` movies per request.
+
+    Uses Radarr v3's bulk movie editor, at ``/api/v3/movie/editor`` whether the
+    instance's base URL is ``.../api`` (like `DEFAULT_INSTANCE`) or ``.../api/v3``.
+    If the first bulk request says the endpoint doesn't exist (see
+    `MOVIE_EDITOR_MISSING_STATUSES`), movies are PUT one at a time like
+    `set_profile` does, for this and later calls against the same instance.  Any
+    other error is raised.
+
+    With a stub transport standing in for Radarr:
+
+    >>> class Response:
+    ...     def __init__(self, status_code):
+    ...         self.status_code, self.ok = status_code, status_code < 400
+    ...     def json(self):
+    ...         return {}
+    ...     def raise_for_status(self):
+    ...         if not self.ok:
+    ...             raise RuntimeError(self.status_code)
+    >>> class Stub:
+    ...     def __init__(self, editor_status):
+    ...         self.editor_status = editor_status
+    ...     def http(self, instance, method, path, kwargs, send):
+    ...         if path.endswith(MOVIE_EDITOR_PATH):
+    ...             print(method, path, kwargs["json"]["movieIds"])
+    ...             return Response(self.editor_status)
+    ...         print(method, path, kwargs["json"]["id"])
+    ...         return Response(200)
+    >>> movies = [{"id": i} for i in range(5)]
+
+    Movies go out ``chunk_size`` ids at a time:
+
+    >>> set_transport(Stub(202))
+    >>> with use_instance(RadarrInstance("v3", "http://radarr/api", "key")):
+    ...     set_profiles(movies, 2, chunk_size=2)
+    PUT /v3/movie/editor [0, 1]
+    PUT /v3/movie/editor [2, 3]
+    PUT /v3/movie/editor [4]
+
+    A server without the endpoint gets one PUT per movie from then on:
+
+    >>> set_transport(Stub(404))
+    >>> old = RadarrInstance("old", "http://radarr/api", "key")
+    >>> with use_instance(old):
+    ...     set_profiles(movies, 2, chunk_size=2)
+    PUT /v3/movie/editor [0, 1]
+    Bulk movie editor not available on old (404), updating movies one at a time.
+    PUT /movie 0
+    PUT /movie 1
+    PUT /movie 2
+    PUT /movie 3
+    PUT /movie 4
+    >>> old.supports_movie_editor
+    False
+
+    Other errors aren't mistaken for a missing endpoint, including a 400 for a
+    request the server didn't like:
+
+    >>> set_transport(Stub(400))
+    >>> picky = RadarrInstance("picky", "http://radarr/api", "key")
+    >>> with use_instance(picky):
+    ...     set_profiles(movies, 99, chunk_size=2)
+    Traceback (most recent call last):
+    ...
+    RuntimeError: 400
+    >>> print(picky.supports_movie_editor)
+    None
+    >>> set_transport(Stub(502))
+    >>> flaky = RadarrInstance("flaky", "http://radarr/api/v3", "key")
+    >>> with use_instance(flaky):
+    ...     set_profiles(movies, 2, chunk_size=2)
+    Traceback (most recent call last):
+    ...
+    RuntimeError: 502
+    >>> print(flaky.supports_movie_editor)
+    None
+    >>> set_transport(None)
+    """
+    movies = list(movies)
+    for movie in movies:
+        movie["profileId"] = profile_id
+        movie["qualityProfileId"] = profile_id
+
+    instance = current_instance()
+    editor_path = MOVIE_EDITOR_PATH
+    if not instance.base_url.endswith("/v3"):
+        editor_path = "/v3" + MOVIE_EDITOR_PATH
+
+    for start in range(0, len(movies), chunk_size):
+        chunk = movies[start : start + chunk_size]
+        if instance.supports_movie_editor is not False:
+            response = _put(
+                editor_path,
+                {"movieIds": [m["id"] for m in chunk], "qualityProfileId": profile_id},
+            )
+            if response.ok:
+                instance.supports_movie_editor = True
+                continue
+            if (
+                instance.supports_movie_editor
+                or response.status_code not in MOVIE_EDITOR_MISSING_STATUSES
+            ):
+                response.raise_for_status()
+            print(
+                f"Bulk movie editor not available on {instance.name} "
+                f"({response.status_code}), updating movies one at a time."
+            )
+            instance.supports_movie_editor = False
+
+        for movie in chunk:
+            _put(MOVIE_PATH, movie).raise_for_status()
+
+
+def assign_profiles(
+    assignments: Iterable[Tuple[MutableMapping[str, Any], int]],
+    chunk_size: int = BULK_EDIT_CHUNK_SIZE,
+):
+    """Apply (movie, profile id) pairs with one `set_profiles` per target profile."""
+    by_profile: MutableMapping[int, List[MutableMapping[str, Any]]] = {}
+    for movie, profile_id in assignments:
+        by_profile.setdefault(profile_id, []).append(movie)
+
+    for profile_id, movies in by_profile.items():
+        set_profiles(movies, profile_id, chunk_size)
+
+
 def update_moviefile(data: Mapping[str, Any]):
     return _put(MOVIEFILE_PATH, data).json()
 
@@ -178,6 +421,10 @@ def get_movies():
     return _get(MOVIE_PATH).json()
 
 
+def get_movie(id_: int):
+    return _get(f"{MOVIE_PATH}/{id_}").json()
+
+
 def get_movie_by_title(title: str, exact=False, case_sensitive=False):
     def does_match(movie):
         if exact and case_sensitive:
@@ -215,8 +462,10 @@ def get_movies_for_profile(profile_id: int):
             yield movie
 
 
-def get_movies_for_downloaded_quality(quality_name: str):
-    for movie in get_movies():
+def get_movies_for_downloaded_quality(
+    quality_name: str, movies: Optional[Iterable[Mapping[str, Any]]] = None
+):
+    for movie in get_movies() if movies is None else movies:
         name = (
             movie.get("movieFile", {})
             .get("quality", {})
@@ -228,10 +477,8 @@ def get_movies_for_downloaded_quality(quality_name: str):
 
 
 def force_search_for_existing_movies(movie_ids: Sequence[int]):
-    response = requests.post(
-        BASE_URL + COMMAND_PATH,
-        json={"name": "moviesSearch", "movieIds": list(movie_ids)},
-        params=BASE_QUERY,
+    response = _post(
+        COMMAND_PATH, {"name": "moviesSearch", "movieIds": list(movie_ids)}
     )
 
     return response.json()
@@ -248,20 +495,31 @@ def get_command_status(command_id: int):
             return status
 
 
-def find_data_from_smb_nfo(
-    movie: Mapping[str, Any],
+def smb_connect(
     smb_user: str,
     smb_password: str,
     smb_server_name: str,
     smb_server_ip: str,
-    path_share_map: Mapping[str, str],
     workgroup: str = "",
-    matchers: Sequence[Union[str, Pattern]] = None,
-) -> List[str]:
-    from smb.SMBConnection import SMBConnection
+):
+    def _connect():
+        return _smb_connect(
+            smb_user, smb_password, smb_server_name, smb_server_ip, workgroup
+        )
+
+    if _transport is not None:
+        return _transport.smb(_connect)
+    return _connect()
 
-    if matchers is None:
-        matchers = ["bluray"]
+
+def _smb_connect(
+    smb_user: str,
+    smb_password: str,
+    smb_server_name: str,
+    smb_server_ip: str,
+    workgroup: str = "",
+):
+    from smb.SMBConnection import SMBConnection
 
     global client_machine_name
     if client_machine_name is None:
@@ -270,33 +528,47 @@ def find_data_from_smb_nfo(
         )
         assert client_machine_name, "Cannot determine host name."
 
-    def _connect():
-        conn = SMBConnection(
-            smb_user,
-            smb_password,
-            client_machine_name,
-            smb_server_name,
-            domain=workgroup,
-            use_ntlm_v2=True,
-            is_direct_tcp=True,
-        )
-        conn.connect(smb_server_ip, 445)
-        return conn
+    conn = SMBConnection(
+        smb_user,
+        smb_password,
+        client_machine_name,
+        smb_server_name,
+        domain=workgroup,
+        use_ntlm_v2=True,
+        is_direct_tcp=True,
+    )
+    conn.connect(smb_server_ip, 445)
+    return conn
 
-    with closing(_connect()) as conn:
-        # verify movie path is something we know how to handle
-        found = False
-        movie_path_prefix = None
-        for path_prefix in path_share_map:
-            if movie["folderName"].startswith(path_prefix):
-                movie_path_prefix = path_prefix
-                found = True
-                break
 
-        assert found, f'Unknown path: {movie["folderName"]}'
+def share_path(path: str, path_share_map: Mapping[str, str]) -> Tuple[str, str]:
+    """Translate a path as Radarr sees it into (share, path on share)."""
+    for path_prefix in path_share_map:
+        if path.startswith(path_prefix):
+            return path_share_map[path_prefix], path.replace(path_prefix, "", 1)
+
+    raise ValueError(f"Unknown path: {path}")
+
+
+def find_data_from_smb_nfo(
+    movie: Mapping[str, Any],
+    smb_user: str,
+    smb_password: str,
+    smb_server_name: str,
+    smb_server_ip: str,
+    path_share_map: Mapping[str, str],
+    workgroup: str = "",
+    matchers: Sequence[Union[str, Pattern]] = None,
+) -> List[str]:
+    if matchers is None:
+        matchers = ["bluray"]
 
-        movie_share = path_share_map[movie_path_prefix]
-        movie_path = movie["folderName"].replace(movie_path_prefix, "")
+    conn = smb_connect(
+        smb_user, smb_password, smb_server_name, smb_server_ip, workgroup
+    )
+    with closing(conn):
+        # verify movie path is something we know how to handle
+        movie_share, movie_path = share_path(movie["folderName"], path_share_map)
 
         files = conn.listPath(movie_share, movie_path, pattern="*.nfo")
 
@@ -323,11 +595,15 @@ def find_data_from_smb_nfo(
         return matching_lines
 
 
-def update_audio():
+def update_audio(
+    movies: Optional[Iterable[Mapping[str, Any]]] = None,
+    custom_formats: Optional[Mapping[str, CustomFormat]] = None,
+):
     count = 0
-    custom_formats = get_custom_formats()
+    if custom_formats is None:
+        custom_formats = get_custom_formats()
     needs_updating = []
-    for movie in get_movies():
+    for movie in get_movies() if movies is None else movies:
         if not movie.get("movieFile"):
             continue
         count += 1
@@ -353,25 +629,33 @@ def update_audio():
         add_custom_format(custom_formats["Complex Surround"], moviefile)
 
 
-def fixit():
+def fixit(
+    movies: Optional[Iterable[MutableMapping[str, Any]]] = None,
+    chunk_size: int = BULK_EDIT_CHUNK_SIZE,
+):
+    from dateutil import parser
+
     recent = []
     today = datetime.now(timezone.utc) - timedelta(hours=3)
     more_audio_profile = get_profile_by_name("most (audio)")
     assert more_audio_profile
     import_more_audio_profile = get_profile_by_name("import-most-audio")
     assert import_more_audio_profile
-    for movie in get_movies():
+    for movie in get_movies() if movies is None else movies:
         added = parser.parse(movie["added"])
         if added > today and movie["profileId"] == more_audio_profile["id"]:
-            set_profile(movie, import_more_audio_profile["id"])
             recent.append(movie)
 
+    set_profiles(recent, import_more_audio_profile["id"], chunk_size)
     pprint([m["title"] for m in recent])
 
 
-def update_unk_blu_complex():
+def update_unk_blu_complex(
+    movies: Optional[Iterable[Mapping[str, Any]]] = None,
+    custom_formats: Optional[Mapping[str, CustomFormat]] = None,
+):
     updates = []
-    for movie in get_movies_for_downloaded_quality("Unknown"):
+    for movie in get_movies_for_downloaded_quality("Unknown", movies):
         width = get_by_path(movie, ["movieFile", "mediaInfo", "width"], 0)
         channels = get_by_path(movie, ["movieFile", "mediaInfo", "audioChannels"], 0)
         if 1900 <= width <= 1920 and channels > 3:
@@ -379,7 +663,9 @@ def update_unk_blu_complex():
 
     if updates:
         blu_qual = get_quality_by_name("Bluray-1080p")
-        custom_formats = [get_custom_formats()["Complex Surround"]]
+        if custom_formats is None:
+            custom_formats = get_custom_formats()
+        custom_formats = [custom_formats["Complex Surround"]]
         assert blu_qual
         for movie in updates:
             print(movie["title"])
@@ -393,17 +679,22 @@ def update_unk_blu_complex():
     print(len(updates))
 
 
-if __name__ == "__main__":
-    # update_unk_blu_complex()
-    # pprint(get_custom_formats())
-    # exit()
-    profile_map = {
-        "import-most-audio": "most (audio)",
-        "import-most-space": "most (space)",
-        "import-1080-ok": "1080p's ok",
-        "import-highest": "highest",
-    }
+# source profile name -> profile to move movies to once they've been searched
+PROFILE_MIGRATIONS = {
+    "import-most-audio": "most (audio)",
+    "import-most-space": "most (space)",
+    "import-1080-ok": "1080p's ok",
+    "import-highest": "highest",
+}
 
+
+def migrate_profiles(
+    profile_map: Mapping[str, str] = PROFILE_MIGRATIONS,
+    start_at_index: int = 0,
+    end_at_index: Optional[int] = None,
+    chunk_size: int = BULK_EDIT_CHUNK_SIZE,
+):
+    """Search for movies on an "import-" profile, then move them to its target."""
     profiles_by_id = {p["id"]: p for p in get_profiles()}
     profile_names = [p["name"] for p in profiles_by_id.values()]
     assert all([n in profile_names for n in profile_map.keys()])
@@ -423,9 +714,9 @@ if __name__ == "__main__":
         assert source_id and dest_id
         profile_id_map[source_id] = dest_id
 
-    start_at_index = 0
     movies = list(get_movies())
-    end_at_index = len(movies)
+    if end_at_index is None:
+        end_at_index = len(movies)
     movies_to_search = []
     for idx, movie in enumerate(movies):
         if idx == end_at_index:
@@ -443,6 +734,7 @@ if __name__ == "__main__":
             # if profile_name.startswith(""):
             movies_to_search.append(movie)
 
+    assignments = []
     for idx, movie in enumerate(movies_to_search):
         print(f"Movie {idx+1} of {len(movies_to_search)}")
         print("Searching for ", movie["title"], "...", end="")
@@ -457,9 +749,24 @@ if __name__ == "__main__":
 
         new_profile_id = profile_id_map[movie["profileId"]]
         print(
-            f'Updating profile from {profiles_by_id[movie["profileId"]]["name"]} to '
+            f"Queueing profile change from "
+            f'{profiles_by_id[movie["profileId"]]["name"]} to '
             f"{profiles_by_id[new_profile_id]['name']}"
         )
-        set_profile(movie, new_profile_id)
+        assignments.append((movie, new_profile_id))
+
+        # change profiles in bulk, but often enough that stopping partway through
+        # (this loop is slow) doesn't lose the changes for movies already searched
+        if len(assignments) >= chunk_size:
+            assign_profiles(assignments, chunk_size)
+            assignments = []
+
+    assign_profiles(assignments, chunk_size)
 
     print("\ndone")
+
+
+if __name__ == "__main__":
+    from radarrutils import main
+
+    main(["migrate-profiles", *sys.argv[1:]])
@@ -0,0 +1,334 @@
+"""Command line entry point for the radarr utilities.
+
+Each subcommand imports what it needs when it runs, so ``--help`` and cheap
+commands don't pay for ``requests``, ``dateutil``, ``smb`` or ``PySimpleGUI``.
+
+Nothing heavy is loaded just by building the parser:
+
+>>> sorted(imported_after(["--help"]) & HEAVY_MODULES)
+[]
+>>> sorted(imported_after(["report", "--help"]) & HEAVY_MODULES)
+[]
+
+...and startup stays within budget:
+
+>>> measure_startup() < STARTUP_BUDGET
+True
+
+So does reporting on a large library (see `report.measure_report`):
+
+>>> from report import REPORT_BUDGET, measure_report
+>>> measure_report() < REPORT_BUDGET
+True
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from typing import Optional, Sequence, Set
+
+# seconds for `radarrutils.py --help`, including interpreter startup
+STARTUP_BUDGET = 0.5
+
+HEAVY_MODULES = {"requests", "dateutil", "smb", "PySimpleGUI"}
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _migrate_profiles(args):
+    from radarrapi import migrate_profiles
+
+    migrate_profiles(
+        start_at_index=args.start, end_at_index=args.end, chunk_size=args.chunk_size
+    )
+
+
+def _update_audio(args):
+    from radarrapi import update_audio
+
+    update_audio()
+
+
+def _fix_unknowns(args):
+    from radarrapi import update_unk_blu_complex
+
+    update_unk_blu_complex()
+
+
+def _fix_recent(args):
+    from radarrapi import fixit
+
+    fixit(chunk_size=args.chunk_size)
+
+
+def _review_gui(args):
+    from quality_update import review_unknowns
+
+    review_unknowns(
+        args.smb_user, args.smb_pass, args.smb_server_name, args.smb_server_ip
+    )
+
+
+def _find_duplicates(args):
+    from dupes import scan
+
+    scan(
+        args.smb_user,
+        args.smb_pass,
+        args.smb_server_name,
+        args.smb_server_ip,
+        sample_size=args.sample_size,
+        confirm=not args.quick,
+        max_workers=args.workers,
+    )
+
+
+def _report(args):
+    from report import run_report
+
+    run_report(args.group_by, args.format, args.snapshot, args.refresh)
+
+
+def _watch(args):
+    from webhook import serve
+
+    serve(
+        args.host, args.port, args.delay, args.max_delay, args.username, args.password
+    )
+
+
+def _fix_movies(args):
+    from webhook import fix_movies
+
+    fix_movies(args.movie_ids)
+
+
+def _compare_instances(args):
+    from multi_instance import compare_instances
+
+    compare_instances(args.instances)
+
+
+def _add_smb_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--smb-user", "-su", required=True, help="Username for SMB")
+    parser.add_argument("--smb-pass", "-sp", required=True, help="Password for SMB")
+    parser.add_argument(
+        "--smb-server-name", "-sn", required=True, help="SMB server name."
+    )
+    parser.add_argument("--smb-server-ip", "-si", required=True, help="SMB server IP.")
+
+
+def _positive_int(value: str) -> int:
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be a positive integer: {value}")
+    return number
+
+
+def build_parser() -> argparse.ArgumentParser:
+    # radarrapi only needs the standard library until a request is made
+    from radarrapi import BULK_EDIT_CHUNK_SIZE
+
+    parser = argparse.ArgumentParser(
+        prog="radarrutils", description="Radarr library maintenance tools."
+    )
+    traffic = parser.add_mutually_exclusive_group()
+    traffic.add_argument(
+        "--record", metavar="FILE", help="Record Radarr and SMB traffic to FILE."
+    )
+    traffic.add_argument(
+        "--replay",
+        metavar="FILE",
+        help="Serve Radarr and SMB traffic from a recording instead of the servers.",
+    )
+    parser.add_argument(
+        "--latency-scale",
+        type=float,
+        default=1.0,
+        help="With --replay, multiply recorded latencies by this (0 for none).",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate = subparsers.add_parser(
+        "migrate-profiles",
+        help='Search movies on "import-" profiles and move them to their target.',
+    )
+    migrate.add_argument("--start", type=int, default=0, help="First movie index.")
+    migrate.add_argument("--end", type=int, help="Stop before this movie index.")
+    migrate.add_argument(
+        "--chunk-size",
+        type=_positive_int,
+        default=BULK_EDIT_CHUNK_SIZE,
+        help="Movies per bulk profile update.",
+    )
+    migrate.set_defaults(func=_migrate_profiles)
+
+    subparsers.add_parser(
+        "update-audio", help="Add Complex Surround to surround sound movie files."
+    ).set_defaults(func=_update_audio)
+
+    subparsers.add_parser(
+        "fix-unknowns",
+        help="Mark unknown-quality 1080p surround files as Bluray-1080p.",
+    ).set_defaults(func=_fix_unknowns)
+
+    fix_recent = subparsers.add_parser(
+        "fix-recent", help="Move recently added movies to their import profile."
+    )
+    fix_recent.add_argument(
+        "--chunk-size",
+        type=_positive_int,
+        default=BULK_EDIT_CHUNK_SIZE,
+        help="Movies per bulk profile update.",
+    )
+    fix_recent.set_defaults(func=_fix_recent)
+
+    review = subparsers.add_parser(
+        "review-gui", help="Update radarr file qualities for unknown quality files."
+    )
+    _add_smb_arguments(review)
+    review.set_defaults(func=_review_gui)
+
+    duplicates = subparsers.add_parser(
+        "find-duplicates",
+        help="Find duplicate films across the shares and files Radarr doesn't know.",
+    )
+    _add_smb_arguments(duplicates)
+    duplicates.add_argument(
+        "--sample-size",
+        type=_positive_int,
+        default=64 * 1024,
+        help="Bytes read from the head, middle and tail of same-size files.",
+    )
+    duplicates.add_argument(
+        "--quick",
+        action="store_true",
+        help="Trust matching samples instead of confirming with a full hash.",
+    )
+    duplicates.add_argument(
+        "--workers",
+        type=_positive_int,
+        default=4,
+        help="SMB connections to scan with.",
+    )
+    duplicates.set_defaults(func=_find_duplicates)
+
+    # report only needs the standard library, so it's fine to import it here
+    from report import GROUP_KEYS, WRITERS
+
+    report = subparsers.add_parser("report", help="Report library storage usage.")
+    report.add_argument(
+        "group_by", nargs="+", choices=sorted(GROUP_KEYS), help="Keys to group by."
+    )
+    report.add_argument(
+        "--format",
+        "-f",
+        choices=sorted(WRITERS),
+        default="table",
+        help="Output format.",
+    )
+    report.add_argument(
+        "--snapshot",
+        "-s",
+        help="Library snapshot file.  Created from Radarr if it doesn't exist.",
+    )
+    report.add_argument(
+        "--refresh", action="store_true", help="Re-fetch the snapshot from Radarr."
+    )
+    report.set_defaults(func=_report)
+
+    watch = subparsers.add_parser(
+        "watch", help="Apply library fixups to movies as Radarr imports them."
+    )
+    watch.add_argument("--host", default="127.0.0.1", help="Address to listen on.")
+    watch.add_argument("--port", type=int, default=8787, help="Port to listen on.")
+    watch.add_argument(
+        "--delay",
+        type=float,
+        default=30.0,
+        help="Seconds without new imports before processing a batch.",
+    )
+    watch.add_argument(
+        "--max-delay",
+        type=float,
+        default=300.0,
+        help="Longest a queued movie waits before being processed.",
+    )
+    watch.add_argument("--username", help="Username Radarr sends with webhooks.")
+    watch.add_argument("--password", help="Password Radarr sends with webhooks.")
+    watch.set_defaults(func=_watch)
+
+    fix_movies = subparsers.add_parser(
+        "fix-movies", help="Run the import fixups on specific movies."
+    )
+    fix_movies.add_argument("movie_ids", nargs="+", type=int, help="Radarr movie ids.")
+    fix_movies.set_defaults(func=_fix_movies)
+
+    compare = subparsers.add_parser(
+        "compare-instances", help="Compare the libraries of several Radarr instances."
+    )
+    compare.add_argument("instances", help="JSON file describing the instances.")
+    compare.set_defaults(func=_compare_instances)
+
+    return parser
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    args = build_parser().parse_args(argv)
+    if not (args.record or args.replay):
+        args.func(args)
+        return
+
+    from radarrapi import set_transport
+    from recording import Recorder, Replayer
+
+    if args.record:
+        transport = Recorder(args.record)
+    else:
+        transport = Replayer(args.replay, args.latency_scale)
+    set_transport(transport)
+    try:
+        args.func(args)
+    finally:
+        set_transport(None)
+        transport.close()
+
+
+def imported_after(argv: Sequence[str]) -> Set[str]:
+    """Top-level modules imported by running the CLI with argv in a fresh process."""
+    code = (
+        "import sys\n"
+        "import radarrutils\n"
+        "try:\n"
+        f"    radarrutils.main({list(argv)!r})\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        "print(' '.join({m.split('.')[0] for m in sys.modules}))\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=_HERE,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return set(output.splitlines()[-1].split())
+
+
+def measure_startup(runs: int = 3) -> float:
+    """Best-of-``runs`` wall time for ``radarrutils.py --help`` in a new process."""
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, os.path.join(_HERE, "radarrutils.py"), "--help"],
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    main()
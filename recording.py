@@ -0,0 +1,399 @@
+"""Capture Radarr/SMB traffic to a file and serve it back later.
+
+A recording is a gzipped file of JSON lines, one per API request or SMB call.
+API keys are stripped from what's recorded and SMB credentials are never seen by
+the recorder (it only wraps the connection once it's open), so a recording of a
+real library can be handed to someone else to profile against.
+
+Install either one with `radarrapi.set_transport`, or use the CLI's ``--record``
+and ``--replay`` options.
+
+Recording a request and an SMB session, with stubs standing in for the network:
+
+>>> import io, os, tempfile
+>>> from types import SimpleNamespace
+>>> from radarrapi import RadarrInstance
+>>> instance = RadarrInstance("hd", "http://radarr/api", "s3cret-key")
+>>> class Response:
+...     def __init__(self, text):
+...         self.status_code, self.text = 200, text
+>>> def send(method, path, **kwargs):
+...     # some Radarr errors echo the request URL, key and all
+...     url = f"{instance.base_url}{path}?apikey={instance.api_key}"
+...     return Response(json.dumps([{"title": "Heat", "url": url}]))
+>>> class Connection:
+...     def __init__(self, password):
+...         self.password = password
+...     def listPath(self, share, path):
+...         heat = SimpleNamespace(filename="Heat.mkv", isDirectory=False, file_size=4)
+...         return [heat]
+...     def retrieveFileFromOffset(self, share, path, file_obj, offset, max_length):
+...         data = b"HEAT"[offset : offset + max_length]
+...         file_obj.write(data)
+...         return 0, len(data)
+>>> def connect():
+...     time.sleep(0.05)
+...     return Connection("smb-password")
+
+>>> path = os.path.join(tempfile.mkdtemp(), "traffic.gz")
+>>> recorder = Recorder(path)
+>>> recorder.http(instance, "GET", "/movie", {}, send).status_code
+200
+>>> conn = recorder.smb(connect)
+>>> [f.filename for f in conn.listPath("Media", "/Heat (1995)")]
+['Heat.mkv']
+>>> conn.retrieveFileFromOffset("Media", "/Heat (1995)/Heat.mkv", io.BytesIO(), 1, 2)
+(0, 2)
+>>> recorder.close()
+
+Neither the API key nor the SMB password make it into the file:
+
+>>> with gzip.open(path, "rt") as f:
+...     recording = f.read()
+>>> "s3cret-key" in recording, "smb-password" in recording
+(False, False)
+
+Replaying serves the same responses and reads, and connecting takes as long as it
+did when recorded:
+
+>>> replayer = Replayer(path)
+>>> replayer.http(instance, "GET", "/movie", {}, send=None).json()
+[{'title': 'Heat', 'url': 'http://radarr/api/movie?apikey=<scrubbed>'}]
+>>> start = time.perf_counter()
+>>> conn = replayer.smb(connect=None)
+>>> time.perf_counter() - start >= 0.05
+True
+>>> [f.filename for f in conn.listPath("Media", "/Heat (1995)")]
+['Heat.mkv']
+>>> data = io.BytesIO()
+>>> conn.retrieveFileFromOffset("Media", "/Heat (1995)/Heat.mkv", data, 1, 2)
+(0, 2)
+>>> data.getvalue()
+b'EA'
+>>> replayer.close()
+"""
+import base64
+import gzip
+import hashlib
+import json
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, Callable, Deque, Dict, List, Mapping, Optional, Tuple
+
+# SMB reads bigger than this are recorded as a digest instead of their contents.
+# Replays of them produce data of the same length that only matches other replayed
+# reads of identical content, which is all the duplicate scanner needs.
+MAX_RECORDED_READ = 1024 * 1024
+
+_PAD = bytes(1024 * 1024)
+
+
+def _http_key(instance_name: str, method: str, path: str, kwargs: Mapping) -> str:
+    return json.dumps(
+        [instance_name, method, path, kwargs.get("params"), kwargs.get("json")],
+        sort_keys=True,
+    )
+
+
+def _loose_http_key(instance_name: str, method: str, path: str) -> str:
+    return json.dumps([instance_name, method, path])
+
+
+def _smb_key(op: str, args: List[Any]) -> str:
+    return json.dumps([op, *args], sort_keys=True)
+
+
+class _Stats:
+    """Call counts and time per layer/operation, printed when a run finishes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = defaultdict(int)
+        self._times: Dict[str, float] = defaultdict(float)
+        self._started = time.perf_counter()
+
+    def add(self, name: str, elapsed: float):
+        with self._lock:
+            self._counts[name] += 1
+            self._times[name] += elapsed
+
+    def print(self, heading: str):
+        wall = time.perf_counter() - self._started
+        print(f"\n{heading} ({wall:.2f}s wall time)", file=sys.stderr)
+        for name in sorted(self._times, key=self._times.get, reverse=True):
+            print(
+                f"  {self._times[name]:8.2f}s {self._counts[name]:6d}x  {name}",
+                file=sys.stderr,
+            )
+
+
+class _SharedFile:
+    """Stands in for pysmb's SharedFile on replay."""
+
+    def __init__(self, filename: str, isDirectory: bool, file_size: int):
+        self.filename = filename
+        self.isDirectory = isDirectory
+        self.file_size = file_size
+
+
+class Recorder:
+    def __init__(self, path: str):
+        self._file = gzip.open(path, "wt")
+        self._lock = threading.Lock()
+        self._secrets: List[str] = []
+        self.stats = _Stats()
+
+    def _write(self, entry: Mapping[str, Any]):
+        line = json.dumps(entry, separators=(",", ":"))
+        for secret in self._secrets:
+            line = line.replace(secret, "<scrubbed>")
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def http(self, instance, method: str, path: str, kwargs: Dict, send: Callable):
+        if instance.api_key and instance.api_key not in self._secrets:
+            self._secrets.append(instance.api_key)
+
+        key = _http_key(instance.name, method, path, kwargs)
+        start = time.perf_counter()
+        response = send(method, path, **kwargs)
+        elapsed = time.perf_counter() - start
+
+        self.stats.add(f"http {method} {path}", elapsed)
+        self._write(
+            {
+                "layer": "http",
+                "key": key,
+                "loose_key": _loose_http_key(instance.name, method, path),
+                "status": response.status_code,
+                "body": response.text,
+                "elapsed": elapsed,
+            }
+        )
+        return response
+
+    def smb(self, connect: Callable):
+        # logging in is often the slowest part of an SMB call, so record it too
+        start = time.perf_counter()
+        conn = connect()
+        self.record_smb("connect", [], None, time.perf_counter() - start)
+        return _RecordingConnection(conn, self)
+
+    def record_smb(self, op: str, args: List[Any], result: Any, elapsed: float):
+        self.stats.add(f"smb {op}", elapsed)
+        self._write(
+            {
+                "layer": "smb",
+                "key": _smb_key(op, args),
+                "result": result,
+                "elapsed": elapsed,
+            }
+        )
+
+    def close(self):
+        self._file.close()
+        self.stats.print("Recorded")
+
+
+class _TeeWriter:
+    def __init__(self, file_obj):
+        self.file_obj = file_obj
+        self.length = 0
+        self.digest = hashlib.blake2b()
+        self.head = bytearray()
+
+    def write(self, data: bytes):
+        self.file_obj.write(data)
+        self.length += len(data)
+        self.digest.update(data)
+        if len(self.head) <= MAX_RECORDED_READ:
+            self.head += data
+        return len(data)
+
+    def result(self) -> Dict[str, Any]:
+        if self.length <= MAX_RECORDED_READ:
+            return {"data": base64.b64encode(bytes(self.head)).decode()}
+        return {"length": self.length, "digest": self.digest.hexdigest()}
+
+
+class _RecordingConnection:
+    def __init__(self, conn, recorder: Recorder):
+        self._conn = conn
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def listPath(self, service_name: str, path: str, *args, **kwargs):
+        start = time.perf_counter()
+        files = self._conn.listPath(service_name, path, *args, **kwargs)
+        self._recorder.record_smb(
+            "listPath",
+            [service_name, path, *args, kwargs],
+            [[f.filename, f.isDirectory, f.file_size] for f in files],
+            time.perf_counter() - start,
+        )
+        return files
+
+    def retrieveFile(self, service_name: str, path: str, file_obj, *args, **kwargs):
+        tee = _TeeWriter(file_obj)
+        start = time.perf_counter()
+        result = self._conn.retrieveFile(service_name, path, tee, *args, **kwargs)
+        self._recorder.record_smb(
+            "retrieveFile",
+            [service_name, path],
+            tee.result(),
+            time.perf_counter() - start,
+        )
+        return result
+
+    def retrieveFileFromOffset(
+        self, service_name: str, path: str, file_obj, offset=0, max_length=-1, **kwargs
+    ):
+        tee = _TeeWriter(file_obj)
+        start = time.perf_counter()
+        result = self._conn.retrieveFileFromOffset(
+            service_name, path, tee, offset, max_length, **kwargs
+        )
+        self._recorder.record_smb(
+            "retrieveFileFromOffset",
+            [service_name, path, offset, max_length],
+            tee.result(),
+            time.perf_counter() - start,
+        )
+        return result
+
+
+class ReplayResponse:
+    """Enough of requests' Response for the radarrapi functions."""
+
+    def __init__(self, status_code: int, text: str):
+        self.status_code = status_code
+        self.text = text
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise RuntimeError(f"Replayed HTTP {self.status_code}: {self.text[:200]}")
+
+
+class Replayer:
+    """Serve a recording back, with each call taking its recorded time scaled.
+
+    Calls are matched on their exact request (method, path, params, body and
+    instance) and served in recorded order.  An HTTP request whose body differs
+    from anything recorded, say because it depends on the current time, falls
+    back to the next response recorded for the same method and path.
+    """
+
+    def __init__(self, path: str, latency_scale: float = 1.0):
+        self.latency_scale = latency_scale
+        self.stats = _Stats()
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Deque[Dict[str, Any]]] = defaultdict(deque)
+        self._loose: Dict[str, Deque[Dict[str, Any]]] = defaultdict(deque)
+        with gzip.open(path, "rt") as f:
+            for line in f:
+                entry = json.loads(line)
+                self._entries[entry["key"]].append(entry)
+                if entry["layer"] == "http":
+                    self._loose[entry["loose_key"]].append(entry)
+
+    @staticmethod
+    def _pop(queue: Optional[Deque[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        # entries sit in both indexes, so skip ones already served via the other
+        while queue:
+            entry = queue.popleft()
+            if not entry.get("served"):
+                entry["served"] = True
+                return entry
+        return None
+
+    def _take(
+        self, key: str, loose_key: Optional[str] = None, required: bool = True
+    ) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._pop(self._entries.get(key))
+            if entry is None and loose_key is not None:
+                entry = self._pop(self._loose.get(loose_key))
+            if entry is None:
+                if not required:
+                    return None
+                raise KeyError(f"Not in recording: {key}")
+
+        if self.latency_scale:
+            time.sleep(entry["elapsed"] * self.latency_scale)
+        return entry
+
+    def http(self, instance, method: str, path: str, kwargs: Dict, send: Callable):
+        start = time.perf_counter()
+        entry = self._take(
+            _http_key(instance.name, method, path, kwargs),
+            _loose_http_key(instance.name, method, path),
+        )
+        self.stats.add(f"http {method} {path}", time.perf_counter() - start)
+        return ReplayResponse(entry["status"], entry["body"])
+
+    def smb(self, connect: Callable):
+        # Never connects, so no credentials are needed to replay, but takes as long
+        # as a recorded connection did.  How many connections a run opens can
+        # depend on thread timing, so any beyond those recorded are free.
+        start = time.perf_counter()
+        self._take(_smb_key("connect", []), required=False)
+        self.stats.add("smb connect", time.perf_counter() - start)
+        return _ReplayConnection(self)
+
+    def close(self):
+        self.stats.print("Replayed")
+
+
+class _ReplayConnection:
+    def __init__(self, replayer: Replayer):
+        self._replayer = replayer
+
+    def _take(self, op: str, args: List[Any]):
+        start = time.perf_counter()
+        entry = self._replayer._take(_smb_key(op, args))
+        self._replayer.stats.add(f"smb {op}", time.perf_counter() - start)
+        return entry["result"]
+
+    @staticmethod
+    def _write(result: Mapping[str, Any], file_obj) -> Tuple[int, int]:
+        """Write a recorded read to file_obj, returning what pysmb would."""
+        if "data" in result:
+            data = base64.b64decode(result["data"])
+            file_obj.write(data)
+            return 0, len(data)
+        # digest first so different content hashes differently, then pad to length
+        remaining = result["length"]
+        data = bytes.fromhex(result["digest"])[:remaining]
+        file_obj.write(data)
+        remaining -= len(data)
+        while remaining > 0:
+            file_obj.write(_PAD[:remaining])
+            remaining -= len(_PAD)
+        return 0, result["length"]
+
+    def listPath(self, service_name: str, path: str, *args, **kwargs):
+        result = self._take("listPath", [service_name, path, *args, kwargs])
+        return [_SharedFile(*f) for f in result]
+
+    def retrieveFile(self, service_name: str, path: str, file_obj, *args, **kwargs):
+        return self._write(self._take("retrieveFile", [service_name, path]), file_obj)
+
+    def retrieveFileFromOffset(
+        self, service_name: str, path: str, file_obj, offset=0, max_length=-1, **kwargs
+    ):
+        args = [service_name, path, offset, max_length]
+        return self._write(self._take("retrieveFileFromOffset", args), file_obj)
+
+    def close(self):
+        pass
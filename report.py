@@ -0,0 +1,250 @@
+import csv
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    TextIO,
+    Tuple,
+)
+
+from utils import get_by_path, humanbytes_storage
+
+SNAPSHOT_VERSION = 1
+
+# seconds to build a snapshot of REPORT_BUDGET_MOVIES movies and aggregate it
+REPORT_BUDGET = 1.0
+REPORT_BUDGET_MOVIES = 50_000
+
+
+def _mediainfo(key: str) -> Callable[[Mapping[str, Any]], Any]:
+    return lambda movie: get_by_path(movie, ["movieFile", "mediaInfo", key])
+
+
+def _share(movie: Mapping[str, Any]) -> str:
+    # "/tank2/Media/Some Movie (2001)" -> "tank2"
+    path = movie.get("path") or movie.get("folderName") or ""
+    parts = path.strip("/").split("/")
+    return parts[0] if parts[0] else "(none)"
+
+
+def _audio_layout(movie: Mapping[str, Any]) -> str:
+    audio_format = get_by_path(movie, ["movieFile", "mediaInfo", "audioFormat"])
+    channels = get_by_path(movie, ["movieFile", "mediaInfo", "audioChannels"])
+    return f"{audio_format} {channels}ch"
+
+
+def _resolution(movie: Mapping[str, Any]) -> str:
+    width = get_by_path(movie, ["movieFile", "mediaInfo", "width"]) or 0
+    height = get_by_path(movie, ["movieFile", "mediaInfo", "height"]) or 0
+    return f"{width}x{height}"
+
+
+# Everything a report can be grouped by.  Each extractor pulls one value out of a
+# movie from the /movie endpoint; a snapshot stores one column per extractor.
+GROUP_KEYS: Dict[str, Callable[[Mapping[str, Any]], Any]] = {
+    "quality": lambda movie: get_by_path(
+        movie, ["movieFile", "quality", "quality", "name"]
+    ),
+    "profile": lambda movie: movie.get("qualityProfileId"),
+    "share": _share,
+    "audio": _audio_layout,
+    "audio_format": _mediainfo("audioFormat"),
+    "audio_channels": _mediainfo("audioChannels"),
+    "resolution": _resolution,
+    "video_codec": _mediainfo("videoCodecID"),
+    "container": _mediainfo("containerFormat"),
+    "year": lambda movie: movie.get("year"),
+}
+
+
+def build_snapshot(
+    movies: Sequence[Mapping[str, Any]], profiles: Sequence[Mapping[str, Any]] = ()
+) -> Dict[str, Any]:
+    """Reduce the library to the columns reports need.
+
+    Only movies with a file on disk are kept.  The result is column oriented (one
+    list per key) which keeps it small on disk and fast to aggregate.  Profile ids
+    are replaced with names from ``profiles`` where they're known.
+
+    >>> def movie(profile_id, year, size, movie_file=None):
+    ...     return {
+    ...         "qualityProfileId": profile_id,
+    ...         "year": year,
+    ...         "sizeOnDisk": size,
+    ...         "movieFile": movie_file,
+    ...     }
+    >>> movie_file = {"mediaInfo": {"audioChannels": 6}}
+    >>> movies = [movie(1, 2001, 5, movie_file), movie(7, 2001, 3, movie_file)]
+    >>> movies.append(movie(1, 2002, 0))  # not downloaded yet
+    >>> columns = build_snapshot(movies, [{"id": 1, "name": "highest"}])["columns"]
+    >>> columns["profile"], columns["year"], columns["size"]
+    (['highest', 7], [2001, 2001], [5, 3])
+    """
+    profile_names = {p["id"]: p["name"] for p in profiles}
+    with_files = [m for m in movies if m.get("movieFile")]
+
+    columns = {
+        key: [extract(movie) for movie in with_files]
+        for key, extract in GROUP_KEYS.items()
+    }
+    columns["profile"] = [profile_names.get(p, p) for p in columns["profile"]]
+    columns["size"] = [movie.get("sizeOnDisk") or 0 for movie in with_files]
+
+    return {"version": SNAPSHOT_VERSION, "columns": columns}
+
+
+def save_snapshot(snapshot: Mapping[str, Any], path: str):
+    with open(path, "w") as f:
+        json.dump(snapshot, f, separators=(",", ":"))
+
+
+def load_snapshot(path: str) -> Dict[str, Any]:
+    with open(path) as f:
+        snapshot = json.load(f)
+    assert (
+        snapshot.get("version") == SNAPSHOT_VERSION
+    ), f"{path} is from an older version, refresh it."
+    return snapshot
+
+
+def fetch_snapshot() -> Dict[str, Any]:
+    from radarrapi import get_movies, get_profiles
+
+    return build_snapshot(get_movies(), get_profiles())
+
+
+def aggregate(
+    snapshot: Mapping[str, Any], group_by: Sequence[str]
+) -> List[Tuple[Tuple[Any, ...], int, int]]:
+    """Sum sizes by the given keys in one pass.
+
+    Returns ``(key values, movie count, total bytes)`` rows, largest first.
+
+    >>> snapshot = {
+    ...     "columns": {
+    ...         "profile": ["highest", "highest", "most (space)"],
+    ...         "year": [2001, 2002, 2001],
+    ...         "size": [5, 3, 4],
+    ...     }
+    ... }
+    >>> aggregate(snapshot, ["profile"])
+    [(('highest',), 2, 8), (('most (space)',), 1, 4)]
+    >>> for row in aggregate(snapshot, ["year", "profile"]):
+    ...     print(row)
+    ((2001, 'highest'), 1, 5)
+    ((2001, 'most (space)'), 1, 4)
+    ((2002, 'highest'), 1, 3)
+    """
+    columns = snapshot["columns"]
+    unknown = [k for k in group_by if k not in GROUP_KEYS]
+    if unknown:
+        raise ValueError(f"Unknown group-by keys: {unknown}")
+
+    counts: Dict[Tuple[Any, ...], int] = defaultdict(int)
+    sizes: Dict[Tuple[Any, ...], int] = defaultdict(int)
+    for key, size in zip(zip(*[columns[k] for k in group_by]), columns["size"]):
+        counts[key] += 1
+        sizes[key] += size
+
+    rows = [(key, counts[key], sizes[key]) for key in sizes]
+    rows.sort(key=lambda row: row[2], reverse=True)
+    return rows
+
+
+def write_table(rows, group_by: Sequence[str], out: TextIO):
+    header = [*group_by, "movies", "size"]
+    lines = [
+        [*(str(k) for k in key), str(count), humanbytes_storage(size)]
+        for key, count, size in rows
+    ]
+    total_count = sum(row[1] for row in rows)
+    total_size = sum(row[2] for row in rows)
+    padding = [""] * (len(group_by) - 1)
+    lines.append(["total", *padding, str(total_count), humanbytes_storage(total_size)])
+
+    widths = [max(len(cell) for cell in col) for col in zip(header, *lines)]
+    for line in [header, *lines]:
+        print("  ".join(cell.ljust(w) for cell, w in zip(line, widths)), file=out)
+
+
+def write_csv(rows, group_by: Sequence[str], out: TextIO):
+    writer = csv.writer(out)
+    writer.writerow([*group_by, "movies", "bytes"])
+    for key, count, size in rows:
+        writer.writerow([*key, count, size])
+
+
+def write_json(rows, group_by: Sequence[str], out: TextIO):
+    json.dump(
+        [
+            {**dict(zip(group_by, key)), "movies": count, "bytes": size}
+            for key, count, size in rows
+        ],
+        out,
+        indent=2,
+    )
+    out.write("\n")
+
+
+WRITERS = {"table": write_table, "csv": write_csv, "json": write_json}
+
+
+def measure_report(movie_count: int = REPORT_BUDGET_MOVIES) -> float:
+    """Seconds to snapshot and aggregate a synthetic library of ``movie_count``."""
+    profiles = [{"id": i, "name": f"profile {i}"} for i in range(10)]
+    movies = [
+        {
+            "path": f"/tank{i % 4 + 1}/Media/Movie {i}",
+            "year": 1950 + i % 70,
+            "qualityProfileId": i % 10,
+            "sizeOnDisk": i * 1024,
+            "movieFile": {
+                "quality": {"quality": {"name": f"quality {i % 12}"}},
+                "mediaInfo": {
+                    "audioFormat": "DTS",
+                    "audioChannels": i % 8,
+                    "width": 1920,
+                    "height": 1080,
+                    "videoCodecID": "h264",
+                    "containerFormat": "Matroska",
+                },
+            },
+        }
+        for i in range(movie_count)
+    ]
+    start = time.perf_counter()
+    snapshot = build_snapshot(movies, profiles)
+    aggregate(snapshot, ["share", "quality", "audio"])
+    return time.perf_counter() - start
+
+
+def run_report(
+    group_by: Sequence[str],
+    output_format: str = "table",
+    snapshot_path: Optional[str] = None,
+    refresh: bool = False,
+    out: TextIO = sys.stdout,
+):
+    if snapshot_path and os.path.exists(snapshot_path) and not refresh:
+        snapshot = load_snapshot(snapshot_path)
+    else:
+        snapshot = fetch_snapshot()
+        if snapshot_path:
+            save_snapshot(snapshot, snapshot_path)
+
+    WRITERS[output_format](aggregate(snapshot, group_by), group_by, out)
+
+
+if __name__ == "__main__":
+    from radarrutils import main
+
+    main(["report", *sys.argv[1:]])
@@ -0,0 +1,307 @@
+"""Listen for Radarr's webhooks and fix up movies as they're imported.
+
+Below, a real server feeds a batcher whose ``process`` just reports the batches it
+gets, standing in for `process_movies`.  Movie 2 never gets processed
+successfully:
+
+>>> import queue, urllib.error, urllib.request
+>>> batches, messages = queue.Queue(), queue.Queue()
+>>> def process(ids):
+...     batches.put(ids)
+...     return [2] if 2 in ids else []
+>>> batcher = MovieBatcher(
+...     process, delay=0.2, max_delay=2, max_attempts=2, log=messages.put
+... )
+>>> server = ThreadingHTTPServer(
+...     ("127.0.0.1", 0), make_handler(batcher, "radarr", "secret")
+... )
+>>> threading.Thread(target=server.serve_forever, daemon=True).start()
+>>> def post(body, password="secret"):
+...     token = base64.b64encode(f"radarr:{password}".encode()).decode()
+...     request = urllib.request.Request(
+...         f"http://127.0.0.1:{server.server_port}/",
+...         data=body.encode(),
+...         headers={"Authorization": f"Basic {token}"},
+...     )
+...     try:
+...         return urllib.request.urlopen(request).status
+...     except urllib.error.HTTPError as e:
+...         return e.code
+
+Imports arriving together are processed as one batch.  Other events and bodies
+without a movie are acknowledged and ignored:
+
+>>> post('{"eventType": "Download", "movie": {"id": 2}}')
+204
+>>> post('{"eventType": "Download", "movie": {"id": 1}}')
+204
+>>> post('{"eventType": "Test", "movie": {"id": 3}}')
+204
+>>> post('{"eventType": "Download", "movie": null}')
+204
+>>> batches.get(timeout=5)
+[1, 2]
+
+Bodies that aren't a JSON object, or come without the right credentials, are
+refused:
+
+>>> post("[1]"), post("not json"), post("{}", password="wrong")
+(400, 400, 401)
+
+Movies that fail are retried on their own, and given up on after
+``max_attempts``:
+
+>>> batches.get(timeout=5)
+[2]
+>>> messages.get(timeout=5)
+'Giving up on movies after 2 attempts.  Re-run them with: radarrutils fix-movies 2'
+>>> server.shutdown()
+>>> server.server_close()
+"""
+import base64
+import contextvars
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Set
+
+from radarrapi import (
+    CustomFormat,
+    fixit,
+    get_custom_formats,
+    get_movie,
+    update_audio,
+    update_unk_blu_complex,
+)
+from utils import get_by_path
+
+# "Download" covers both On Import and On Upgrade (the latter sets isUpgrade).
+HANDLED_EVENTS = {"Download", "MovieAdded"}
+
+
+class MovieBatcher:
+    """Collect movie ids and hand them off in debounced batches.
+
+    A batch is processed once no new ids have arrived for ``delay`` seconds, or
+    ``max_delay`` seconds after the first id in the batch, whichever is sooner.
+    That way a burst of imports from one grab costs one pass instead of one per
+    file, and a steady trickle still gets handled.
+
+    ``process`` returns the ids it couldn't handle (or raises, failing the whole
+    batch).  Those are tried again after ``delay`` seconds, doubling with each
+    attempt, up to ``max_attempts`` times in all, after which they're logged as a
+    command that re-runs them.
+    """
+
+    def __init__(
+        self,
+        process: Callable[[List[int]], Optional[Iterable[int]]],
+        delay: float = 30.0,
+        max_delay: float = 300.0,
+        max_attempts: int = 5,
+        log: Callable[[str], None] = print,
+    ):
+        self.process = process
+        self.delay = delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.log = log
+        self._cond = threading.Condition()
+        self._ids: Set[int] = set()
+        self._first_at = self._last_at = 0.0
+        # failed id -> when to try it again
+        self._retry_at: Dict[int, float] = {}
+        # only touched by the batcher thread
+        self._attempts: Dict[int, int] = {}
+        # keep the instance of whoever started the batcher (see use_instance)
+        self._thread = threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(self._run,),
+            name="webhook-batcher",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def add(self, movie_id: int):
+        with self._cond:
+            now = time.monotonic()
+            if not self._ids:
+                self._first_at = now
+            self._last_at = now
+            self._ids.add(movie_id)
+            # a new event for a movie waiting on a retry brings it forward
+            self._retry_at.pop(movie_id, None)
+            self._cond.notify_all()
+
+    def _next_batch(self) -> List[int]:
+        """Wait for new ids to settle or a retry to come due, and take them."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                batch_due = float("inf")
+                if self._ids:
+                    batch_due = min(
+                        self._last_at + self.delay, self._first_at + self.max_delay
+                    )
+                due = min([batch_due, *self._retry_at.values()])
+                if due <= now:
+                    break
+                self._cond.wait(None if due == float("inf") else due - now)
+
+            batch = {id_ for id_, at in self._retry_at.items() if at <= now}
+            for movie_id in batch:
+                del self._retry_at[movie_id]
+            if batch_due <= now:
+                batch |= self._ids
+                self._ids = set()
+            return sorted(batch)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                failed = set(self.process(batch) or ())
+            except Exception as e:
+                self.log(f"Failed processing movies {batch}: {e!r}")
+                failed = set(batch)
+
+            for movie_id in batch:
+                if movie_id not in failed:
+                    self._attempts.pop(movie_id, None)
+            if failed:
+                self._retry(sorted(failed))
+
+    def _retry(self, failed: List[int]):
+        given_up = []
+        with self._cond:
+            now = time.monotonic()
+            for movie_id in failed:
+                attempts = self._attempts.get(movie_id, 0) + 1
+                if attempts < self.max_attempts:
+                    self._attempts[movie_id] = attempts
+                    self._retry_at[movie_id] = now + self.delay * 2 ** (attempts - 1)
+                else:
+                    self._attempts.pop(movie_id, None)
+                    given_up.append(movie_id)
+            self._cond.notify_all()
+
+        if given_up:
+            ids = " ".join(str(movie_id) for movie_id in given_up)
+            self.log(
+                f"Giving up on movies after {self.max_attempts} attempts.  "
+                f"Re-run them with: radarrutils fix-movies {ids}"
+            )
+
+
+def process_movies(
+    movie_ids: List[int], custom_formats: Mapping[str, CustomFormat]
+) -> List[int]:
+    """Run the library fixups against just the given movies.
+
+    Movies are fixed up one at a time so a failure only counts against its own
+    movie.  Movies whose file Radarr hasn't analysed yet (no ``mediaInfo``) are
+    skipped.  Returns the ids of movies that failed or were skipped.
+    """
+    print(f"Processing {len(movie_ids)} movies: {movie_ids}")
+    failed = []
+    for movie_id in movie_ids:
+        try:
+            done = _process_movie(movie_id, custom_formats)
+        except Exception as e:
+            print(f"Failed processing movie {movie_id}: {e!r}")
+            done = False
+        if not done:
+            failed.append(movie_id)
+    return failed
+
+
+def _process_movie(movie_id: int, custom_formats: Mapping[str, CustomFormat]) -> bool:
+    movie = get_movie(movie_id)
+    if movie.get("movieFile") and not get_by_path(movie, ["movieFile", "mediaInfo"]):
+        print(f"{movie['title']} hasn't been analysed yet, skipping it for now.")
+        return False
+
+    # Each job changes the data the next one looks at, so re-read the movie
+    # before each of them.
+    update_unk_blu_complex([movie], custom_formats)
+    update_audio([get_movie(movie_id)], custom_formats)
+    fixit([get_movie(movie_id)])
+    return True
+
+
+def fix_movies(movie_ids: List[int]):
+    """Run the fixups for movies by hand, e.g. ones the listener gave up on."""
+    failed = process_movies(movie_ids, get_custom_formats())
+    if failed:
+        print(f"Could not process movies: {' '.join(str(id_) for id_ in failed)}")
+
+
+def make_handler(
+    batcher: MovieBatcher, username: Optional[str], password: Optional[str]
+):
+    expected_auth = None
+    if username is not None:
+        token = base64.b64encode(f"{username}:{password or ''}".encode()).decode()
+        expected_auth = f"Basic {token}"
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if expected_auth and self.headers.get("Authorization") != expected_auth:
+                self.send_response(401)
+                self.send_header("WWW-Authenticate", 'Basic realm="radarrutils"')
+                self.end_headers()
+                return
+
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                payload = json.loads(self.rfile.read(length))
+            except ValueError:
+                payload = None
+            if not isinstance(payload, dict):
+                self.send_response(400)
+                self.end_headers()
+                return
+
+            movie = payload.get("movie")
+            movie_id = movie.get("id") if isinstance(movie, dict) else None
+            if payload.get("eventType") in HANDLED_EVENTS and isinstance(movie_id, int):
+                batcher.add(movie_id)
+
+            self.send_response(204)
+            self.end_headers()
+
+    return Handler
+
+
+def serve(
+    host: str = "127.0.0.1",
+    port: int = 8787,
+    delay: float = 30.0,
+    max_delay: float = 300.0,
+    username: Optional[str] = None,
+    password: Optional[str] = None,
+):
+    # Looking up custom formats means walking the whole library (see
+    # get_custom_formats), so do it once up front rather than per batch.
+    custom_formats = get_custom_formats()
+
+    batcher = MovieBatcher(
+        lambda ids: process_movies(ids, custom_formats), delay, max_delay
+    )
+    handler = make_handler(batcher, username, password)
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"Listening for Radarr webhooks on http://{host}:{port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    from radarrutils import main
+
+    main(["watch", *sys.argv[1:]])